@@ -1,3 +1,4 @@
+import math
 from typing import Callable, List, Union
 
 import numpy as np
@@ -23,14 +24,16 @@ class _TruncExp(Function):  # pylint: disable=abstract-method
     @staticmethod
     @custom_fwd(cast_inputs=torch.float32)
     def forward(ctx, x):  # pylint: disable=arguments-differ
-        ctx.save_for_backward(x)
-        return torch.exp(x)
+        y = torch.exp(x)
+        # exp is monotonic, so clamping its output equals exp(clamp(x, max=15))
+        # and saves recomputing the exp in backward
+        ctx.save_for_backward(torch.clamp(y, max=math.exp(15)))
+        return y
 
     @staticmethod
     @custom_bwd
     def backward(ctx, g):  # pylint: disable=arguments-differ
-        x = ctx.saved_tensors[0]
-        return g * torch.exp(torch.clamp(x, max=15))
+        return g * ctx.saved_tensors[0]
 
 
 trunc_exp = _TruncExp.apply
@@ -38,30 +41,52 @@ trunc_exp = _TruncExp.apply
 
 def contract_to_unisphere(
     x: torch.Tensor,
-    aabb: torch.Tensor,
+    aabb_offset: torch.Tensor,
+    aabb_inv_size: torch.Tensor,
     eps: float = 1e-6,
     derivative: bool = False,
 ):
-    aabb_min, aabb_max = torch.split(aabb, 3, dim=-1)
-    x = (x - aabb_min) / (aabb_max - aabb_min)
+    x = torch.addcmul(aabb_offset, x, aabb_inv_size)
     x = x * 2 - 1  # aabb is at [-1, 1]
     mag = x.norm(dim=-1, keepdim=True)
-    mask = mag.squeeze(-1) > 1
+    mask = mag > 1
 
     if derivative:
         dev = (2 * mag - 1) / mag**2 + 2 * x**2 * (
             1 / mag**3 - (2 * mag - 1) / mag**4
         )
-        dev[~mask] = 1.0
+        dev = torch.where(mask, dev, torch.ones_like(dev))
         dev = torch.clamp(dev, min=eps)
         return dev
     else:
-        x[mask] = (2 - 1 / mag[mask]) * (x[mask] / mag[mask])
+        # evaluate the contraction everywhere and select, instead of a masked
+        # gather/scatter; the clamp keeps the unselected lanes finite
+        mag = mag.clamp(min=eps)
+        x = torch.where(mask, (2 - 1 / mag) * (x / mag), x)
         x = x / 4 + 0.5  # [-inf, inf] is at [0, 1]
         return x
 
 
-def safe_normalize(x: torch.Tensor):
+@torch.jit.script
+def _add_density_bias(
+    h: torch.Tensor, x: torch.Tensor, density_bias_scale: float, offset_scale: float
+) -> torch.Tensor:
+    # scripted so, after the profiling runs, the elementwise tail (sqrt, bias
+    # and add) can fuse; the squared-norm reduction stays a separate kernel
+    tau = density_bias_scale * (
+        1 - torch.sqrt((x**2).sum(-1, keepdim=True)) / offset_scale
+    )
+    return h + tau
+
+
+@torch.jit.script
+def shifted_softplus(x: torch.Tensor) -> torch.Tensor:
+    # scripted so the shift and softplus run as a single kernel
+    return F.softplus(x - 1.0)
+
+
+@torch.jit.script
+def safe_normalize(x: torch.Tensor) -> torch.Tensor:
     return x / torch.sqrt(torch.clamp(torch.sum(x * x, -1, keepdim=True), min=1e-20))
 
 
@@ -73,13 +98,15 @@ class NGPradianceField(torch.nn.Module):
         aabb: Union[torch.Tensor, List[float]],
         num_dim: int = 3,
         use_viewdirs: bool = True,
-        density_activation: Callable = lambda x: F.softplus(x - 1),
+        density_activation: Callable = shifted_softplus,
         unbounded: bool = False,
         base_resolution: int = 16,
         max_resolution: int = 4096,
-        geo_feat_dim: int = 31,
-        n_levels: int = 16,
+        geo_feat_dim: int = 39,
+        n_levels: int = 10,
+        n_features_per_level: int = 4,
         log2_hashmap_size: int = 19,
+        interpolation: str = "Linear",
         use_normal_net: bool = True,
         density_bias_scale: int = 10,
         offset_scale: float = 0.5,
@@ -90,6 +117,7 @@ class NGPradianceField(torch.nn.Module):
             aabb = torch.tensor(aabb, dtype=torch.float32)
         self.register_buffer("aabb", aabb)
         self.num_dim = num_dim
+        self._update_aabb_buffers()
         self.use_viewdirs = use_viewdirs
         self.density_activation = density_activation
         self.unbounded = unbounded
@@ -97,7 +125,11 @@ class NGPradianceField(torch.nn.Module):
         self.density_bias_scale = density_bias_scale
         self.offset_scale = offset_scale
         self.use_bkgd_net = use_bkgd_net
+        # lazily created CUDA streams for running mlp_rgb and mlp_normal together
+        self._side_streams = None
 
+        # the whole hash-grid output is used as [density feature, geo features]
+        assert n_levels * n_features_per_level == 1 + geo_feat_dim
         self.geo_feat_dim = geo_feat_dim
         per_level_scale = np.exp(
             (np.log(max_resolution) - np.log(base_resolution)) / (n_levels - 1)
@@ -124,11 +156,11 @@ class NGPradianceField(torch.nn.Module):
             encoding_config={
                 "otype": "HashGrid",
                 "n_levels": n_levels,
-                "n_features_per_level": 2,
+                "n_features_per_level": n_features_per_level,
                 "log2_hashmap_size": log2_hashmap_size,
                 "base_resolution": base_resolution,
                 "per_level_scale": per_level_scale,
-                "interpolation": "Smoothstep",
+                "interpolation": interpolation,
             },
             dtype=torch.float32,  # float16 will cause NaN issue
         )
@@ -139,7 +171,7 @@ class NGPradianceField(torch.nn.Module):
                 "otype": "FullyFusedMLP",
                 "activation": "ReLU",
                 "output_activation": "None",
-                "n_neurons": 32,
+                "n_neurons": 64,
                 "n_hidden_layers": 1,
             },
         )
@@ -154,7 +186,7 @@ class NGPradianceField(torch.nn.Module):
                 "otype": "FullyFusedMLP",
                 "activation": "ReLU",
                 "output_activation": "Sigmoid",
-                "n_neurons": 32,
+                "n_neurons": 64,
                 "n_hidden_layers": 1,
             },
         )
@@ -171,7 +203,7 @@ class NGPradianceField(torch.nn.Module):
                     "otype": "FullyFusedMLP",
                     "activation": "ReLU",
                     "output_activation": "Sigmoid",
-                    "n_neurons": 32,
+                    "n_neurons": 64,
                     "n_hidden_layers": 1,
                 },
             )
@@ -190,44 +222,82 @@ class NGPradianceField(torch.nn.Module):
                 },
             )
 
-    def density_bias(self, x, density_bias_scale: int = 10, offset_scale: int = 0.5):
-        tau = density_bias_scale * (1 - torch.sqrt((x**2).sum(-1)) / offset_scale)
-        return tau[:, None]
+        # tcnn >= 2.0 can runtime-compile kernels fused for the current shapes
+        if hasattr(tcnn, "supports_jit_fusion") and tcnn.supports_jit_fusion():
+            for name in ["mlp_sigma", "mlp_rgb", "mlp_normal", "mlp_bkgd"]:
+                if hasattr(self, name):
+                    getattr(self, name).jit_fusion = True
+
+    def _update_aabb_buffers(self):
+        # fp32 affine map of the aabb to [0, 1], cached so query_density only
+        # runs one addcmul; the buffers are non-persistent, so they are rebuilt
+        # whenever aabb changes
+        aabb_min, aabb_max = torch.split(self.aabb.float(), self.num_dim, dim=-1)
+        aabb_inv_size = 1.0 / (aabb_max - aabb_min)
+        self.register_buffer(
+            "aabb_offset", (-aabb_min * aabb_inv_size).contiguous(), persistent=False
+        )
+        self.register_buffer(
+            "aabb_inv_size", aabb_inv_size.contiguous(), persistent=False
+        )
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "aabb" and "aabb_inv_size" in self._buffers:
+            self._update_aabb_buffers()
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+        self._update_aabb_buffers()
 
     def query_density(self, x, return_feat: bool = False):
-        density_bias = self.density_bias(x)
+        positions = x
 
         if self.unbounded:
-            x = contract_to_unisphere(x, self.aabb)
+            x = contract_to_unisphere(x, self.aabb_offset, self.aabb_inv_size)
         else:
-            aabb_min, aabb_max = torch.split(self.aabb, self.num_dim, dim=-1)
-            x = (x - aabb_min) / (aabb_max - aabb_min)
-        selector = ((x > 0.0) & (x < 1.0)).all(dim=-1)
-
-        x = (
-            self.mlp_encoder(x.view(-1, self.num_dim))
-            .view(list(x.shape[:-1]) + [1 + self.geo_feat_dim])
-            .to(x)
+            x = torch.addcmul(self.aabb_offset, x, self.aabb_inv_size)
+        # inside the unit cube iff the smallest coordinate is > 0 and the largest
+        # < 1; keep the trailing dim so the mask multiplies straight into density
+        selector = (x.amin(dim=-1, keepdim=True) > 0.0) & (
+            x.amax(dim=-1, keepdim=True) < 1.0
         )
 
-        # add density bias to pre-activation
-        density_before_activation = self.mlp_sigma(x) + density_bias
+        # the encoder is pinned to float32, so its output needs no cast
+        if x.dim() == 2:
+            x = self.mlp_encoder(x)
+        else:
+            x = self.mlp_encoder(x.view(-1, self.num_dim)).view(
+                list(x.shape[:-1]) + [1 + self.geo_feat_dim]
+            )
 
-        density = (
-            self.density_activation(density_before_activation) * selector[..., None]
+        # add density bias to pre-activation
+        density_before_activation = _add_density_bias(
+            self.mlp_sigma(x),
+            positions,
+            float(self.density_bias_scale),
+            float(self.offset_scale),
         )
 
+        density = self.density_activation(density_before_activation) * selector
+
         if return_feat:
             return density, x, density_before_activation
         else:
             return density
 
-    def _compute_embedding(self, dir, embedding):
+    def encode_directions(self, dir):
         # tcnn requires directions in the range [0, 1]
+        dir = (dir + 1.0) / 2.0
+        return self.direction_encoding(dir.view(-1, dir.shape[-1]))
+
+    def _compute_embedding(self, dir, embedding, dir_encoding=None):
         if self.use_viewdirs:
-            dir = (dir + 1.0) / 2.0
-            d = self.direction_encoding(dir.view(-1, dir.shape[-1]))
-            return torch.cat([d, embedding.view(-1, 1 + self.geo_feat_dim)], dim=-1)
+            if dir_encoding is None:
+                dir_encoding = self.encode_directions(dir)
+            return torch.cat(
+                [dir_encoding, embedding.view(-1, 1 + self.geo_feat_dim)], dim=-1
+            )
         else:
             return embedding.view(-1, 1 + self.geo_feat_dim)
 
@@ -237,10 +307,37 @@ class NGPradianceField(torch.nn.Module):
     def _query_normal(self, embedding):
         return self.mlp_normal(embedding)
 
-    def query_bkgd(self, dir):
-        dir = (dir + 1.0) / 2.0
-        d = self.direction_encoding(dir.view(-1, dir.shape[-1]))
-        return self.mlp_bkgd(d)
+    def _query_rgb_and_normal(self, embedding):
+        if not embedding.is_cuda:
+            return self._query_rgb(embedding), self._query_normal(embedding)
+
+        # the two MLPs only share the read-only embedding and are small enough
+        # to be launch bound, so overlap them on side streams
+        if self._side_streams is None:
+            self._side_streams = (torch.cuda.Stream(), torch.cuda.Stream())
+        rgb_stream, normal_stream = self._side_streams
+        current_stream = torch.cuda.current_stream()
+
+        rgb_stream.wait_stream(current_stream)
+        normal_stream.wait_stream(current_stream)
+        with torch.cuda.stream(rgb_stream):
+            rgb = self._query_rgb(embedding)
+        with torch.cuda.stream(normal_stream):
+            normal = self._query_normal(embedding)
+        current_stream.wait_stream(rgb_stream)
+        current_stream.wait_stream(normal_stream)
+
+        # keep the caching allocator from reusing memory across streams too early
+        embedding.record_stream(rgb_stream)
+        embedding.record_stream(normal_stream)
+        rgb.record_stream(current_stream)
+        normal.record_stream(current_stream)
+        return rgb, normal
+
+    def query_bkgd(self, dir, dir_encoding=None):
+        if dir_encoding is None:
+            dir_encoding = self.encode_directions(dir)
+        return self.mlp_bkgd(dir_encoding)
 
     def forward(
         self,
@@ -248,10 +345,11 @@ class NGPradianceField(torch.nn.Module):
         directions: torch.Tensor = None,
         shading: str = "albedo",
         light_direction: torch.Tensor = None,
+        dir_encoding: torch.Tensor = None,
     ):
         if shading == "albedo":
             density, embedding, _ = self.query_density(positions, return_feat=True)
-            embedding = self._compute_embedding(directions, embedding)
+            embedding = self._compute_embedding(directions, embedding, dir_encoding)
             rgb = self._query_rgb(embedding)
             normal = None
         else:
@@ -261,12 +359,12 @@ class NGPradianceField(torch.nn.Module):
                 density, embedding, density_before_activation = self.query_density(
                     positions, return_feat=True
                 )
-                embedding = self._compute_embedding(directions, embedding)
-                rgb = self._query_rgb(embedding)
+                embedding = self._compute_embedding(directions, embedding, dir_encoding)
 
                 if self.use_normal_net:
-                    normal = self._query_normal(embedding)
+                    rgb, normal = self._query_rgb_and_normal(embedding)
                 else:
+                    rgb = self._query_rgb(embedding)
                     # https://github.com/nerfstudio-project/nerfstudio/blob/main/nerfstudio/fields/base_field.py#L87
                     normal = -torch.autograd.grad(
                         density_before_activation,
@@ -274,12 +372,13 @@ class NGPradianceField(torch.nn.Module):
                         grad_outputs=torch.ones_like(density_before_activation),
                         retain_graph=True,
                     )[0]
-                    normal = safe_normalize(normal).nan_to_num()
+                    normal = safe_normalize(normal).nan_to_num_()
 
             ambient_ratio = 0.1 + 0.9 * np.random.rand()
-            light_direction = light_direction.to(normal.dtype)
+            # normalize the single light vector instead of every per-sample dot
+            light_direction = safe_normalize(light_direction.to(normal.dtype))
             lambertian = ambient_ratio + (1 - ambient_ratio) * (
-                normal @ light_direction / (light_direction**2).sum() ** (1 / 2)
+                normal @ light_direction
             ).clamp(min=0).unsqueeze(-1)
 
             if shading == "textureless":
@@ -4,7 +4,6 @@ import os
 import imageio
 import numpy as np
 import torch
-import torch.nn.functional as F
 from einops import rearrange
 from nerfacc.estimators.occ_grid import OccGridEstimator
 from tqdm import trange
@@ -64,7 +63,6 @@ if __name__ == "__main__":
 
     radiance_field = NGPradianceField(
         aabb=scene_aabb,
-        density_activation=lambda x: F.softplus(x - 1),
         use_normal_net=config['use_normal_net'],
         use_bkgd_net=config['use_bkgd_net'],
         density_bias_scale=config['density_bias_scale'],
@@ -117,7 +117,11 @@ def render_image_with_occgrid(
         )[0][-1, :3, -1]
 
         rgbs, sigmas, normals = radiance_field(
-            positions, t_dirs, shading, light_direction
+            positions,
+            t_dirs,
+            shading,
+            light_direction,
+            dir_encoding[ray_indices] if dir_encoding is not None else None,
         )
         return rgbs, sigmas.squeeze(-1), normals
 
@@ -138,8 +142,12 @@ def render_image_with_occgrid(
             alpha_thre=alpha_thre,
         )
 
+        # encode each ray direction once and share it between the background
+        # net and the per-sample embeddings
+        dir_encoding = None
         if use_bkgd_net:
-            render_bkgd = radiance_field.query_bkgd(chunk_rays.viewdirs)
+            dir_encoding = radiance_field.encode_directions(chunk_rays.viewdirs)
+            render_bkgd = radiance_field.query_bkgd(chunk_rays.viewdirs, dir_encoding)
 
         # use customized rendering function to render normal
         rgb, opacity, depth, normal, weight = custom_rendering(